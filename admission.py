@@ -0,0 +1,90 @@
+import threading
+from contextlib import contextmanager
+
+from flask import current_app
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, retry_after):
+        super().__init__('Too many concurrent write requests')
+        self.retry_after = retry_after
+
+
+class AdmissionGate:
+    # Bounded queue in front of the database writer: at most `limit` requests
+    # run at once, at most `queue_size` wait, and nobody waits longer than
+    # `max_wait` seconds. Everything else is rejected with a retry hint.
+
+    def __init__(self, limit, queue_size, max_wait, retry_after):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    @contextmanager
+    def slot(self):
+        # Free slot: run straight away without touching the queue
+        acquired = self._slots.acquire(blocking=False)
+
+        if not acquired:
+            with self._lock:
+                if self.waiting >= self.queue_size:
+                    self.rejected += 1
+                    raise AdmissionRejected(self.retry_after)
+                self.waiting += 1
+
+            acquired = self._slots.acquire(timeout=self.max_wait)
+
+            with self._lock:
+                self.waiting -= 1
+                if not acquired:
+                    self.rejected += 1
+            if not acquired:
+                raise AdmissionRejected(self.retry_after)
+
+        with self._lock:
+            self.in_flight += 1
+            self.admitted += 1
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'queue_size': self.queue_size,
+                'in_flight': self.in_flight,
+                'queue_depth': self.waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+            }
+
+
+def init_admission(app):
+    app.extensions['admission'] = AdmissionGate(
+        limit=app.config['WRITE_CONCURRENCY'],
+        queue_size=app.config['WRITE_QUEUE_SIZE'],
+        max_wait=app.config['WRITE_MAX_WAIT'],
+        retry_after=app.config['WRITE_RETRY_AFTER'],
+    )
+
+    @app.errorhandler(AdmissionRejected)
+    def _overloaded(exc):
+        return "Serwer jest chwilowo przeciążony. Spróbuj ponownie za chwilę.", 503, {'Retry-After': str(exc.retry_after)}
+
+
+def write_slot():
+    return current_app.extensions['admission'].slot()
+
@@ -1,8 +1,17 @@
 import os
+import hmac
 from datetime import datetime
 from collections import defaultdict
-from flask import Flask, render_template, url_for, request, redirect, session
-from models import db, UserInfo, Group, Test, Subject, Grade, Question, TestQuestion, AnswerOption, StudentAttempt, AttemptAnswer, test_groups
+from flask import Flask, Response, abort, render_template, url_for, request, redirect, session, make_response, jsonify
+from sqlalchemy import select, insert, delete, union, literal, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from models import db, UserInfo, Group, GroupStudent, Test, Subject, Grade, Question, TestQuestion, AnswerOption, StudentAttempt, AttemptAnswer, AttemptResult, ArchivedAttempt, ArchivedGrade, test_groups
+from profiler import init_profiler
+from admission import init_admission, write_slot
+from leaderboard import LeaderboardCache
+from archive import init_archive, unpack_payload
+from live import EventChannel, format_sse, stream
 
 app = Flask(__name__)
 
@@ -15,6 +24,31 @@ app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False # Saves resources/memory
 db.init_app(app)
 
+# Profiling configuration
+# Disabled unless PROFILE_DIR is set; then samples a fraction of requests
+# plus any request carrying a signed X-Profile-Token header
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR')
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+init_profiler(app)
+
+# Admission control for write-heavy endpoints (per worker process)
+# SQLite has a single writer, so bursts are queued briefly and then shed with 503 + Retry-After
+app.config['WRITE_CONCURRENCY'] = int(os.environ.get('WRITE_CONCURRENCY', 2))
+app.config['WRITE_QUEUE_SIZE'] = int(os.environ.get('WRITE_QUEUE_SIZE', 20))
+app.config['WRITE_MAX_WAIT'] = float(os.environ.get('WRITE_MAX_WAIT', 2.0))
+app.config['WRITE_RETRY_AFTER'] = int(os.environ.get('WRITE_RETRY_AFTER', 2))
+# Shared secret for monitoring that polls /metrics/admission without a teacher session
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+init_admission(app)
+
+# Per-test rankings cached in memory; the TTL picks up attempts from other workers
+app.config['LEADERBOARD_TOP_K'] = int(os.environ.get('LEADERBOARD_TOP_K', 10))
+app.config['LEADERBOARD_TTL'] = int(os.environ.get('LEADERBOARD_TTL', 60))
+leaderboards = LeaderboardCache(app.config['LEADERBOARD_TOP_K'], app.config['LEADERBOARD_TTL'])
+
+# Live exam events (started / progress / submitted) for the teacher monitor
+live_events = EventChannel()
+
 
 @app.route('/')
 def index():
@@ -36,15 +70,16 @@ def register():
             if password != confirm_password:
                 return render_template('auth.html', tab='register', error="Hasła się nie zgadzają")
 
-            new_user = UserInfo(
-                first_name=first_name,
-                last_name=last_name,
-                email=email,
-                password=password,
-                role=role
-            )
-            db.session.add(new_user)
-            db.session.commit()
+            with write_slot():
+                new_user = UserInfo(
+                    first_name=first_name,
+                    last_name=last_name,
+                    email=email,
+                    password=password,
+                    role=role
+                )
+                db.session.add(new_user)
+                db.session.commit()
             return redirect(url_for('register', tab='login'))
 
         # Login logic
@@ -80,7 +115,9 @@ def student():
 
         student_user = UserInfo.query.get(user_id)
 
-        grades = Grade.query.filter_by(user_id=user_id).all()
+        # Archived grades from closed terms still count towards the average
+        grades = Grade.query.filter_by(user_id=user_id).all() \
+            + ArchivedGrade.query.filter_by(user_id=user_id).all()
         dist = {str(val): sum(1 for g in grades if g.value == val) for val in [5, 4, 3, 2]}
         average = round(sum(g.value for g in grades) / len(grades), 2) if grades else 0
 
@@ -101,17 +138,34 @@ def student():
         available_tests = [t for t in allowed_tests if t.id not in taken_test_ids]
         test_count = len(available_tests)
 
-        # Last 5 attempts
+        # Last 5 attempts; archived ones are always older, so they only fill the remaining rows
         attempts = StudentAttempt.query.filter_by(student_id=user_id).order_by(StudentAttempt.id.desc()).limit(5).all()
+        archived = []
+        if len(attempts) < 5:
+            archived = ArchivedAttempt.query.filter_by(student_id=user_id) \
+                .order_by(ArchivedAttempt.original_attempt_id.desc()) \
+                .limit(5 - len(attempts)) \
+                .all()
         last_attempts = [
             {
-                "attempt_id": a.id,
+                "url": url_for('student_test_result', attempt_id=a.id),
                 "test_title": a.test.title,
                 "subject_name": a.test.subject.subject_name,
-                "score": int(a.score),
-                "description": a.test.description
+                "score": int(a.score or 0),
+                "description": a.test.description,
+                "term": None
             }
             for a in attempts
+        ] + [
+            {
+                "url": url_for('archived_test_result', archived_id=a.id),
+                "test_title": a.test.title,
+                "subject_name": a.test.subject.subject_name,
+                "score": int(a.score or 0),
+                "description": a.test.description,
+                "term": a.term
+            }
+            for a in archived
         ]
 
         return render_template("student.html", name=name, role=role, grades=grades,
@@ -130,7 +184,10 @@ def available_tests():
     user_id = session['user_id']
     student_user = UserInfo.query.get(user_id)
 
-    taken = db.session.query(StudentAttempt.test_id).filter_by(student_id=user_id).subquery()
+    taken = union(
+        select(StudentAttempt.test_id).where(StudentAttempt.student_id == user_id),
+        select(ArchivedAttempt.test_id).where(ArchivedAttempt.student_id == user_id)
+    ).subquery()
     group_ids = [g.id for g in student_user.groups]
 
     if not group_ids:
@@ -139,7 +196,7 @@ def available_tests():
         tests = Test.query\
             .join(test_groups)\
             .filter(test_groups.c.group_id.in_(group_ids))\
-            .filter(~Test.id.in_(taken))\
+            .filter(~Test.id.in_(select(taken.c.test_id)))\
             .all()
 
     return render_template('student_tests.html', tests=tests)
@@ -168,6 +225,13 @@ def student_test(test_id):
 
     current_question = session.get('current_question', 0)
 
+    # Students who already submitted only reach this page by its URL; opening
+    # it again must not show them as taking the test
+    if request.method == 'GET' and not StudentAttempt.query.filter_by(student_id=session['user_id'], test_id=test.id).first():
+        set_in_progress(test.id, 0, len(questions))
+        live_events.publish(test.id, 'started', student_id=session['user_id'], student=session['user_name'],
+                            questions=len(questions))
+
     if request.method == 'POST':
         selected_option = request.form.get(f'question_{questions[current_question].id}')
         if selected_option:
@@ -180,55 +244,31 @@ def student_test(test_id):
         elif action == 'prev' and current_question > 0:
             current_question -= 1
         elif action == 'submit':
-            score = 0
-            total = 0
-            results = []
-
-            for q in questions:
-                correct_option = next((opt for opt in q.answer_options if opt.is_correct), None)
-                is_correct = str(q.id) in answers and answers[str(q.id)] == correct_option.id if correct_option else False
-                points = question_map.get(q.id, 1)
-                if is_correct:
-                    score += points
-                total += points
-                results.append({"question": q, "correct": is_correct})
-
-            new_attempt = StudentAttempt(
-                student_id=session['user_id'],
-                test_id=test.id,
-                score=score
-            )
-            db.session.add(new_attempt)
-            db.session.commit()
-
-            # Save student answers
-            for qid_str, selected_option_id in answers.items():
-                new_answer = AttemptAnswer(
-                    attempt_id=new_attempt.id,
-                    answer_option_id=selected_option_id
-                )
-                db.session.add(new_answer)
-            db.session.commit()
-
-            # Assign grade based on score percentage
-            percentage = (score / total) * 100 if total > 0 else 0
-            if percentage >= 90:
-                grade_value = 5
-            elif percentage >= 75:
-                grade_value = 4
-            elif percentage >= 50:
-                grade_value = 3
-            else:
-                grade_value = 2
-
-            new_grade = Grade(
-                value=grade_value,
-                user_id=session['user_id'],
-                subject_id=test.subject_id,
-                attempt_id=new_attempt.id
-            )
-            db.session.add(new_grade)
-            db.session.commit()
+            # Submissions share a bounded number of database write slots;
+            # when they are all busy the client is told to retry shortly
+            with write_slot():
+                # A replayed submit (e.g. the first response was lost after the
+                # commit) must not record a second, empty attempt; the unique
+                # constraint settles two submits racing past this check
+                existing = StudentAttempt.query.filter_by(student_id=session['user_id'], test_id=test.id).first()
+                if existing is None:
+                    try:
+                        new_attempt = submit_attempt(test, questions, question_map, answers, session['user_id'])
+                    except IntegrityError:
+                        db.session.rollback()
+                        existing = StudentAttempt.query.filter_by(student_id=session['user_id'], test_id=test.id).first()
+                        if existing is None:
+                            raise
+
+            if existing is not None:
+                session.pop('current_question', None)
+                session.pop('answers', None)
+                return redirect(url_for('student_test_result', attempt_id=existing.id))
+
+            leaderboards.record(test.id, new_attempt.id, session['user_id'], session['user_name'], new_attempt.score)
+            live_events.clear_state(test.id, session['user_id'])
+            live_events.publish(test.id, 'submitted', student_id=session['user_id'], student=session['user_name'],
+                                attempt_id=new_attempt.id, score=new_attempt.score, total=sum(question_map.values()))
 
             session.pop('current_question', None)
             session.pop('answers', None)
@@ -236,6 +276,9 @@ def student_test(test_id):
             return redirect(url_for('student_test_result', attempt_id=new_attempt.id))
 
         session['current_question'] = current_question
+        set_in_progress(test.id, len(answers), len(questions))
+        live_events.publish(test.id, 'progress', student_id=session['user_id'], student=session['user_name'],
+                            answered=len(answers), questions=len(questions))
 
     return render_template(
         'student_take_test.html',
@@ -245,38 +288,191 @@ def student_test(test_id):
     )
 
 
+def set_in_progress(test_id, answered, questions):
+    # Read by teacher_test_live_events for the snapshot sent on connect
+    live_events.set_state(test_id, session['user_id'], {
+        'student_id': session['user_id'],
+        'student': session['user_name'],
+        'answered': answered,
+        'questions': questions,
+    })
+
+
+def submit_attempt(test, questions, question_map, answers, student_id):
+    score = 0
+    total = 0
+
+    new_attempt = StudentAttempt(
+        student_id=student_id,
+        test_id=test.id,
+        score=0
+    )
+    db.session.add(new_attempt)
+    db.session.flush()
+
+    # Grade once at submission; the result page only reads these rows
+    for q in questions:
+        correct_option = next((opt for opt in q.answer_options if opt.is_correct), None)
+        chosen_id = answers.get(str(q.id))
+        is_correct = correct_option is not None and chosen_id == correct_option.id
+        points = question_map.get(q.id, 1)
+        if is_correct:
+            score += points
+        total += points
+        db.session.add(AttemptResult(
+            attempt_id=new_attempt.id,
+            question_id=q.id,
+            chosen_option_id=chosen_id,
+            correct_option_id=correct_option.id if correct_option else None,
+            points_awarded=points if is_correct else 0,
+            points_possible=points
+        ))
+
+    new_attempt.score = score
+
+    # Save student answers
+    for qid_str, selected_option_id in answers.items():
+        new_answer = AttemptAnswer(
+            attempt_id=new_attempt.id,
+            answer_option_id=selected_option_id
+        )
+        db.session.add(new_answer)
+
+    # Assign grade (committed together with the attempt in one transaction) based on score percentage
+    percentage = (score / total) * 100 if total > 0 else 0
+    if percentage >= 90:
+        grade_value = 5
+    elif percentage >= 75:
+        grade_value = 4
+    elif percentage >= 50:
+        grade_value = 3
+    else:
+        grade_value = 2
+
+    new_grade = Grade(
+        value=grade_value,
+        user_id=student_id,
+        subject_id=test.subject_id,
+        attempt_id=new_attempt.id
+    )
+    db.session.add(new_grade)
+    db.session.commit()
+
+    return new_attempt
+
+
 @app.route('/student/test/result/<int:attempt_id>')
 def student_test_result(attempt_id):
-    attempt = StudentAttempt.query.get_or_404(attempt_id)
+    attempt = StudentAttempt.query.options(joinedload(StudentAttempt.test)).get(attempt_id)
+    if attempt is None or attempt.student_id != session.get('user_id'):
+        # Links to attempts moved out by 'flask archive term' keep working for their owner
+        archived = ArchivedAttempt.query \
+            .filter_by(original_attempt_id=attempt_id, student_id=session.get('user_id')) \
+            .order_by(ArchivedAttempt.id.desc()) \
+            .first()
+        if archived is not None:
+            return redirect(url_for('archived_test_result', archived_id=archived.id))
+    if attempt is None:
+        abort(404)
     if session.get('role') != 'student' or attempt.student_id != session.get('user_id'):
         return redirect(url_for('register', tab='login'))
 
-    test = attempt.test
-    test_questions = TestQuestion.query.filter_by(test_id=test.id).all()
+    # Submitted attempts never change; only the ranking moves as others submit
+    board = leaderboards.get(attempt.test_id)
+    etag = f'attempt-{attempt.id}-{board.total}-{board.max_attempt_id}'
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
+    results = AttemptResult.query \
+        .options(joinedload(AttemptResult.question)) \
+        .filter_by(attempt_id=attempt.id) \
+        .order_by(AttemptResult.id) \
+        .all()
+
+    if not results:
+        results = backfill_attempt_results(attempt)
+
+    response = make_response(render_template(
+        'student_test_result.html',
+        test=attempt.test,
+        score=int(attempt.score or 0),
+        total=sum(r.points_possible for r in results),
+        results=results,
+        rank=board.rank_of(attempt.score),
+        percentile=board.percentile_of(attempt.score),
+        attempt_count=board.total,
+        top=board.top
+    ))
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.route('/student/test/archive/<int:archived_id>')
+def archived_test_result(archived_id):
+    attempt = ArchivedAttempt.query.options(joinedload(ArchivedAttempt.test)).get_or_404(archived_id)
+    if session.get('role') != 'student' or attempt.student_id != session.get('user_id'):
+        return redirect(url_for('register', tab='login'))
+
+    results, _ = unpack_payload(attempt.payload)
+    questions = {q.id: q for q in Question.query.filter(Question.id.in_([r['question_id'] for r in results]))}
+    for r in results:
+        r['question'] = questions.get(r['question_id'])
+
+    response = make_response(render_template(
+        'student_test_result.html',
+        test=attempt.test,
+        score=int(attempt.score or 0),
+        total=sum(r['points_possible'] for r in results),
+        results=results,
+        term=attempt.term
+    ))
+    response.set_etag(f'archived-{attempt.id}')
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def backfill_attempt_results(attempt):
+    # Attempts submitted before per-question results were stored
+    test_questions = TestQuestion.query.filter_by(test_id=attempt.test_id).all()
     question_map = {tq.question_id: tq.points for tq in test_questions}
     questions = Question.query.filter(Question.id.in_(question_map.keys())).all()
-
-    results = []
     attempt_answers = {a.answer_option.question_id: a.answer_option_id for a in attempt.answers}
 
-    for q in questions:
-        correct_option = next((opt for opt in q.answer_options if opt.is_correct), None)
-        chosen_id = attempt_answers.get(q.id)
-        is_correct = (chosen_id == correct_option.id) if correct_option else False
-        results.append({
-            "question": q,
-            "correct": is_correct,
-            "selected_option": chosen_id,
-            "correct_option": correct_option.id if correct_option else None
-        })
+    results = []
+    # Nothing is flushed until every row is built, so a conflict surfaces at commit
+    with db.session.no_autoflush:
+        for q in questions:
+            correct_option = next((opt for opt in q.answer_options if opt.is_correct), None)
+            chosen_id = attempt_answers.get(q.id)
+            is_correct = correct_option is not None and chosen_id == correct_option.id
+            points = question_map[q.id]
+            result = AttemptResult(
+                attempt_id=attempt.id,
+                question=q,
+                chosen_option_id=chosen_id,
+                correct_option_id=correct_option.id if correct_option else None,
+                points_awarded=points if is_correct else 0,
+                points_possible=points
+            )
+            db.session.add(result)
+            results.append(result)
 
-    return render_template(
-        'student_test_result.html',
-        test=test,
-        score=int(attempt.score),
-        total=sum(question_map.values()),
-        results=results
-    )
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request backfilled this attempt first; use its rows
+        db.session.rollback()
+        results = AttemptResult.query \
+            .options(joinedload(AttemptResult.question)) \
+            .filter_by(attempt_id=attempt.id) \
+            .order_by(AttemptResult.id) \
+            .all()
+    return results
 
 
 @app.route('/teacher')
@@ -306,24 +502,26 @@ def grades():
     teacher_id = session['user_id']
 
     if request.method == 'POST':
-        try:
-            grade_content = int(request.form['grade'])
-            if grade_content < 2 or grade_content > 5:
-                return "Ocena musi być z zakresu 2–5"
-
-            new_grade = Grade(
-                value=grade_content,
-                user_id=session['user_id'],
-                subject_id=int(request.form['subject_id']),
-                attempt_id=int(request.form['attempt_id'])
-            )
-            db.session.add(new_grade)
-            db.session.commit()
-            return redirect(url_for('grades'))
-        except ValueError:
-            return "Wartość oceny musi być liczbą całkowitą"
-        except Exception as e:
-            return f"Wystąpił błąd: {e}"
+        # Taken outside the try so a full write queue still answers 503
+        with write_slot():
+            try:
+                grade_content = int(request.form['grade'])
+                if grade_content < 2 or grade_content > 5:
+                    return "Ocena musi być z zakresu 2–5"
+
+                new_grade = Grade(
+                    value=grade_content,
+                    user_id=session['user_id'],
+                    subject_id=int(request.form['subject_id']),
+                    attempt_id=int(request.form['attempt_id'])
+                )
+                db.session.add(new_grade)
+                db.session.commit()
+                return redirect(url_for('grades'))
+            except ValueError:
+                return "Wartość oceny musi być liczbą całkowitą"
+            except Exception as e:
+                return f"Wystąpił błąd: {e}"
 
     # GET - fetch grades from tests created by this teacher
     grades = Grade.query \
@@ -331,8 +529,13 @@ def grades():
         .join(Test, StudentAttempt.test_id == Test.id) \
         .filter(Test.teacher_id == teacher_id) \
         .all()
+    archived_grades = ArchivedGrade.query \
+        .join(ArchivedAttempt, ArchivedGrade.attempt_id == ArchivedAttempt.id) \
+        .join(Test, ArchivedAttempt.test_id == Test.id) \
+        .filter(Test.teacher_id == teacher_id) \
+        .all()
 
-    return render_template('grades.html', grades=grades)
+    return render_template('grades.html', grades=grades + archived_grades)
 
 
 @app.route('/groups_teacher', methods=['GET', 'POST'])
@@ -345,7 +548,7 @@ def groups_teacher():
     students = UserInfo.query.filter_by(role='student').all()
 
     selected_group_id = None
-    selected_student_id = None
+    selected_student_ids = []
 
     if request.method == 'POST':
         form = request.form
@@ -353,38 +556,129 @@ def groups_teacher():
         if 'group_name' in form:
             name = form['group_name'].strip()
             if name:
-                new_group = Group(name=name, teacher_id=teacher_id)
-                db.session.add(new_group)
-                db.session.commit()
+                with write_slot():
+                    new_group = Group(name=name, teacher_id=teacher_id)
+                    db.session.add(new_group)
+                    db.session.commit()
             return redirect(url_for('groups_teacher'))
 
-        elif 'action' in form and 'group_id' in form and 'student_id' in form:
-            group_id = int(form['group_id'])
-            student_id = int(form['student_id'])
-            action = form['action']
+        elif 'action' in form and 'group_id' in form:
+            # Fallback without JavaScript; the page normally posts to bulk_group_members
+            try:
+                group_id = int(form['group_id'])
+                action, student_ids, source_group_id = parse_membership_change(form, form.getlist('student_ids'))
+            except ValueError:
+                return "Błąd danych wejściowych.", 400
 
             selected_group_id = group_id
-            selected_student_id = student_id
+            selected_student_ids = student_ids
 
             group = Group.query.filter_by(id=group_id, teacher_id=teacher_id).first()
-            student = UserInfo.query.filter_by(id=student_id, role='student').first()
+            if group:
+                with write_slot():
+                    update_group_members(group.id, action, student_ids, source_group_id, teacher_id)
 
-            if group and student:
-                if action == 'add' and student not in group.students:
-                    group.students.append(student)
-                    db.session.commit()
-                elif action == 'remove' and student in group.students:
-                    group.students.remove(student)
-                    db.session.commit()
+    member_counts = dict(
+        db.session.query(GroupStudent.group_id, func.count(GroupStudent.user_id))
+        .group_by(GroupStudent.group_id)
+        .all()
+    )
 
     return render_template(
         'groups_teacher.html',
         groups=groups,
         students=students,
+        member_counts=member_counts,
         selected_group_id=selected_group_id,
-        selected_student_id=selected_student_id
+        selected_student_ids=selected_student_ids
     )
 
+
+def parse_membership_change(data, raw_ids):
+    # Shared by the bulk endpoint and the form fallback: same field names
+    action = data.get('action')
+    if action not in ('add', 'remove'):
+        raise ValueError('Nieznana akcja')
+    try:
+        student_ids = [int(sid) for sid in raw_ids if sid != '']
+        source_group_id = int(data['source_group_id']) if data.get('source_group_id') else None
+    except (TypeError, ValueError):
+        raise ValueError('Błąd danych wejściowych')
+    return action, student_ids, source_group_id
+
+
+def update_group_members(group_id, action, student_ids, source_group_id, teacher_id):
+    # Candidate students come from the explicit id list and/or another group
+    # owned by the same teacher; duplicates and non-students are dropped in SQL
+    sources = []
+    if student_ids:
+        sources.append(
+            select(UserInfo.id.label('user_id'))
+            .where(UserInfo.id.in_(student_ids), UserInfo.role == 'student')
+        )
+    if source_group_id is not None:
+        sources.append(
+            select(GroupStudent.user_id.label('user_id'))
+            .join(Group, Group.id == GroupStudent.group_id)
+            .where(Group.id == source_group_id, Group.teacher_id == teacher_id)
+        )
+    if not sources:
+        return 0
+
+    candidates = union(*sources).subquery()
+    current_members = select(GroupStudent.user_id).where(GroupStudent.group_id == group_id)
+
+    if action == 'add':
+        # Single INSERT ... SELECT that skips rows already in the group
+        stmt = insert(GroupStudent).from_select(
+            ['group_id', 'user_id'],
+            select(literal(group_id), candidates.c.user_id)
+            .where(candidates.c.user_id.not_in(current_members))
+        )
+    else:
+        stmt = delete(GroupStudent).where(
+            GroupStudent.group_id == group_id,
+            GroupStudent.user_id.in_(select(candidates.c.user_id))
+        )
+
+    changed = db.session.execute(stmt).rowcount
+    db.session.commit()
+    return changed
+
+
+@app.route('/teacher/groups/<int:group_id>/members', methods=['POST'])
+def bulk_group_members(group_id):
+    if session.get('role') != 'nauczyciel':
+        return jsonify(error='Brak uprawnień'), 403
+
+    teacher_id = session['user_id']
+    group = Group.query.filter_by(id=group_id, teacher_id=teacher_id).first()
+    if not group:
+        return jsonify(error='Grupa nie istnieje'), 404
+
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('student_ids', []), list):
+            return jsonify(error='Błąd danych wejściowych'), 400
+        raw_ids = data.get('student_ids', [])
+    else:
+        data = request.form
+        raw_ids = data.getlist('student_ids')
+
+    try:
+        action, student_ids, source_group_id = parse_membership_change(data, raw_ids)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    with write_slot():
+        changed = update_group_members(group.id, action, student_ids, source_group_id, teacher_id)
+        member_count = db.session.scalar(
+            select(func.count()).select_from(GroupStudent).where(GroupStudent.group_id == group.id)
+        )
+
+    return jsonify(group_id=group.id, action=action, changed=changed, member_count=member_count)
+
+
 @app.route('/teacher/groups/<int:group_id>/delete', methods=['POST'])
 def delete_group(group_id):
     if session.get('role') != 'nauczyciel':
@@ -392,10 +686,11 @@ def delete_group(group_id):
 
     group = Group.query.filter_by(id=group_id, teacher_id=session['user_id']).first()
     if group:
-        group.students.clear()
-        group.tests.clear()
-        db.session.delete(group)
-        db.session.commit()
+        with write_slot():
+            group.students.clear()
+            group.tests.clear()
+            db.session.delete(group)
+            db.session.commit()
 
     return redirect(url_for('groups_teacher'))
 
@@ -421,14 +716,15 @@ def create_test():
         subject_id = int(request.form['subject_id'])
         teacher_id = session['user_id']
 
-        new_test = Test(
-            title=title,
-            description=description,
-            subject_id=subject_id,
-            teacher_id=teacher_id
-        )
-        db.session.add(new_test)
-        db.session.commit()
+        with write_slot():
+            new_test = Test(
+                title=title,
+                description=description,
+                subject_id=subject_id,
+                teacher_id=teacher_id
+            )
+            db.session.add(new_test)
+            db.session.commit()
         return redirect(url_for('edit_test', test_id=new_test.id))
 
     subjects = Subject.query.all()
@@ -453,14 +749,15 @@ def edit_test(test_id):
     subjects = Subject.query.all()
 
     if request.method == 'POST':
-        test.title = request.form['title']
-        test.description = request.form['description']
-        test.subject_id = int(request.form['subject_id'])
+        with write_slot():
+            test.title = request.form['title']
+            test.description = request.form['description']
+            test.subject_id = int(request.form['subject_id'])
 
-        selected_group_ids = request.form.getlist('groups')
-        test.groups = Group.query.filter(Group.id.in_(selected_group_ids)).all()
+            selected_group_ids = request.form.getlist('groups')
+            test.groups = Group.query.filter(Group.id.in_(selected_group_ids)).all()
 
-        db.session.commit()
+            db.session.commit()
         return redirect(url_for('teacher_tests'))
 
     groups = Group.query.filter_by(teacher_id=session['user_id']).all()
@@ -474,30 +771,42 @@ def delete_test(test_id):
 
     test = Test.query.get_or_404(test_id)
 
-    # Clean up relationships
-    test.groups.clear()
-
-    # Delete related questions
-    for tq in list(test.test_questions):
-        db.session.delete(tq)
-
-    # Delete attempts and answers
-    for attempt in list(test.attempts):
-        for ans in list(attempt.answers):
-            db.session.delete(ans)
-        grades = Grade.query.filter_by(attempt_id=attempt.id).all()
-        for g in grades:
-            db.session.delete(g)
-        db.session.delete(attempt)
-
-    db.session.delete(test)
-    db.session.commit()
+    with write_slot():
+        # Clean up relationships
+        test.groups.clear()
+
+        # Delete related questions
+        for tq in list(test.test_questions):
+            db.session.delete(tq)
+
+        # Delete attempts and answers
+        for attempt in list(test.attempts):
+            for ans in list(attempt.answers):
+                db.session.delete(ans)
+            for result in list(attempt.results):
+                db.session.delete(result)
+            grades = Grade.query.filter_by(attempt_id=attempt.id).all()
+            for g in grades:
+                db.session.delete(g)
+            db.session.delete(attempt)
+
+        # Archived attempts from closed terms
+        archived_ids = select(ArchivedAttempt.id).where(ArchivedAttempt.test_id == test.id)
+        db.session.execute(delete(ArchivedGrade).where(ArchivedGrade.attempt_id.in_(archived_ids)))
+        db.session.execute(delete(ArchivedAttempt).where(ArchivedAttempt.test_id == test.id))
+
+        db.session.delete(test)
+        db.session.commit()
+    leaderboards.invalidate(test_id)
 
     return redirect(url_for('teacher_tests'))
 
 
 @app.route('/teacher/tests/<int:test_id>/add_question', methods=['GET', 'POST'])
 def add_question_to_test(test_id):
+    if session.get('role') != 'nauczyciel':
+        return redirect(url_for('register', tab='login'))
+
     test = Test.query.get_or_404(test_id)
 
     if request.method == 'POST':
@@ -511,9 +820,10 @@ def add_question_to_test(test_id):
                 existing_question = Question.query.get(question_id)
 
                 if existing_question:
-                    tq = TestQuestion(test_id=test.id, question_id=question_id, points=points)
-                    db.session.add(tq)
-                    db.session.commit()
+                    with write_slot():
+                        tq = TestQuestion(test_id=test.id, question_id=question_id, points=points)
+                        db.session.add(tq)
+                        db.session.commit()
                     return redirect(url_for('edit_test', test_id=test.id))
                 else:
                     return "Pytanie o podanym ID nie istnieje.", 404
@@ -530,21 +840,22 @@ def add_question_to_test(test_id):
                 return "Musisz zaznaczyć dokładnie jedną poprawną odpowiedź.", 400
             correct_index = int(correct_index)
 
-            new_question = Question(text=text)
-            db.session.add(new_question)
-            db.session.flush()
+            with write_slot():
+                new_question = Question(text=text)
+                db.session.add(new_question)
+                db.session.flush()
 
-            for i in range(1, 5):
-                ans_text = form.get(f'answer_{i}')
-                is_correct = (i == correct_index)
+                for i in range(1, 5):
+                    ans_text = form.get(f'answer_{i}')
+                    is_correct = (i == correct_index)
 
-                if ans_text:
-                    option = AnswerOption(text=ans_text, is_correct=is_correct, question=new_question)
-                    db.session.add(option)
+                    if ans_text:
+                        option = AnswerOption(text=ans_text, is_correct=is_correct, question=new_question)
+                        db.session.add(option)
 
-            tq = TestQuestion(test_id=test.id, question_id=new_question.id, points=points)
-            db.session.add(tq)
-            db.session.commit()
+                tq = TestQuestion(test_id=test.id, question_id=new_question.id, points=points)
+                db.session.add(tq)
+                db.session.commit()
             return redirect(url_for('edit_test', test_id=test.id))
 
     existing_questions = Question.query.order_by(Question.id.desc()).limit(10).all()
@@ -553,18 +864,22 @@ def add_question_to_test(test_id):
 
 @app.route('/teacher/questions/<int:question_id>/edit', methods=['GET', 'POST'])
 def edit_question(question_id):
+    if session.get('role') != 'nauczyciel':
+        return redirect(url_for('register', tab='login'))
+
     question = Question.query.get_or_404(question_id)
 
     if request.method == 'POST':
-        question.text = request.form['question_text']
-        db.session.commit()
+        with write_slot():
+            question.text = request.form['question_text']
+            db.session.commit()
 
-        # Update options
-        for option in question.answer_options:
-            option.text = request.form.get(f'option_{option.id}')
-            option.is_correct = f'is_correct_{option.id}' in request.form
+            # Update options
+            for option in question.answer_options:
+                option.text = request.form.get(f'option_{option.id}')
+                option.is_correct = f'is_correct_{option.id}' in request.form
 
-        db.session.commit()
+            db.session.commit()
         return redirect(url_for('teacher_tests'))
 
     return render_template('edit_question.html', question=question)
@@ -572,10 +887,14 @@ def edit_question(question_id):
 
 @app.route('/teacher/tests/<int:test_id>/remove_question/<int:question_id>')
 def remove_question_from_test(test_id, question_id):
+    if session.get('role') != 'nauczyciel':
+        return redirect(url_for('register', tab='login'))
+
     tq = TestQuestion.query.filter_by(test_id=test_id, question_id=question_id).first()
     if tq:
-        db.session.delete(tq)
-        db.session.commit()
+        with write_slot():
+            db.session.delete(tq)
+            db.session.commit()
 
     return redirect(url_for('edit_test', test_id=test_id))
 
@@ -586,22 +905,90 @@ def teacher_test_results(test_id):
         return redirect(url_for('register', tab='login'))
 
     test = Test.query.get_or_404(test_id)
+    board = leaderboards.get(test.id)
+    total_points = test.total_points
 
     results = []
     for a in test.attempts:
         results.append({
             'student': a.student,
             'score': a.score,
-            'total_points': test.total_points
+            'total_points': total_points,
+            'rank': board.rank_of(a.score),
+            'percentile': board.percentile_of(a.score)
+        })
+    for a in test.archived_attempts:
+        results.append({
+            'student': a.student,
+            'score': a.score,
+            'total_points': total_points,
+            'term': a.term
         })
 
     return render_template(
         'teacher_test_results.html',
         test=test,
-        results=results
+        results=results,
+        top=board.top
     )
 
 
+@app.route('/teacher/tests/<int:test_id>/live')
+def teacher_test_live(test_id):
+    if session.get('role') != 'nauczyciel':
+        return redirect(url_for('register', tab='login'))
+
+    test = Test.query.get_or_404(test_id)
+    return render_template('teacher_test_live.html', test=test)
+
+
+@app.route('/teacher/tests/<int:test_id>/live/events')
+def teacher_test_live_events(test_id):
+    if session.get('role') != 'nauczyciel':
+        return redirect(url_for('register', tab='login'))
+
+    test = Test.query.get_or_404(test_id)
+
+    # Subscribe before reading the current state so no event falls in
+    # between; the page dedupes by attempt and student id
+    q = live_events.subscribe(test.id)
+    try:
+        attempts = db.session.execute(
+            select(StudentAttempt.id, StudentAttempt.student_id, StudentAttempt.score)
+            .where(StudentAttempt.test_id == test.id, StudentAttempt.score.is_not(None))
+        ).all()
+        snapshot = format_sse('snapshot', {
+            'attempts': [[a.id, a.student_id, a.score] for a in attempts],
+            'in_progress': list(live_events.state(test.id).values()),
+            'total': test.total_points
+        })
+    except Exception:
+        live_events.unsubscribe(test.id, q)
+        raise
+    db.session.remove()
+
+    response = Response(stream(q, snapshot), mimetype='text/event-stream')
+    response.call_on_close(lambda: live_events.unsubscribe(test_id, q))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _has_metrics_token():
+    expected = app.config.get('METRICS_TOKEN')
+    token = request.headers.get('X-Metrics-Token', '')
+    return bool(expected) and hmac.compare_digest(token, expected)
+
+
+@app.route('/metrics/admission')
+def admission_metrics():
+    # Readable by teachers and by monitoring that sends the configured token;
+    # the client address is not trusted, since behind a proxy it is always local
+    if session.get('role') != 'nauczyciel' and not _has_metrics_token():
+        return redirect(url_for('register', tab='login'))
+    return jsonify(app.extensions['admission'].stats())
+
+
 @app.route('/logout')
 def logout():
     session.clear()
@@ -638,6 +1025,9 @@ def student_subjects():
     )
 
 
+init_archive(app, backfill_attempt_results)
+
+
 if __name__ == "__main__":
     with app.app_context():
         db.create_all()
@@ -0,0 +1,137 @@
+import json
+import zlib
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select, delete, text
+from sqlalchemy.orm import selectinload
+
+from models import db, Grade, StudentAttempt, AttemptAnswer, AttemptResult, ArchivedAttempt, ArchivedGrade
+
+archive_cli = AppGroup('archive', help='Move attempts from closed terms out of the live tables.')
+
+BATCH_SIZE = 500
+
+
+def pack_payload(results, answer_option_ids):
+    # One row per question becomes one compact list per attempt:
+    # [question_id, chosen_option_id, correct_option_id, points_awarded, points_possible]
+    data = {
+        'results': [
+            [r.question_id, r.chosen_option_id, r.correct_option_id, r.points_awarded, r.points_possible]
+            for r in results
+        ],
+        'answers': answer_option_ids,
+    }
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def unpack_payload(payload):
+    data = json.loads(zlib.decompress(payload).decode('utf-8'))
+    results = [
+        {
+            'question_id': question_id,
+            'chosen_option_id': chosen_id,
+            'correct_option_id': correct_id,
+            'points_awarded': awarded,
+            'points_possible': possible,
+            'correct': chosen_id is not None and chosen_id == correct_id,
+        }
+        for question_id, chosen_id, correct_id, awarded, possible in data['results']
+    ]
+    return results, data['answers']
+
+
+def load_batch(condition):
+    # Results, answers and grades for the whole batch in three queries
+    # instead of three lazy loads per attempt
+    return StudentAttempt.query \
+        .options(selectinload(StudentAttempt.results),
+                 selectinload(StudentAttempt.answers),
+                 selectinload(StudentAttempt.grade)) \
+        .filter(condition) \
+        .order_by(StudentAttempt.id) \
+        .limit(BATCH_SIZE) \
+        .all()
+
+
+def archive_batch(attempts, term, backfill_results):
+    attempt_ids = [a.id for a in attempts]
+    test_ids = {a.test_id for a in attempts}
+
+    # Backfilling commits (expiring the batch), so do it before anything is
+    # moved and then load the batch again with the new rows
+    missing = [a for a in attempts if not a.results]
+    if missing:
+        for attempt in missing:
+            backfill_results(attempt)
+        attempts = load_batch(StudentAttempt.id.in_(attempt_ids))
+
+    for attempt in attempts:
+        results = attempt.results
+        archived = ArchivedAttempt(
+            original_attempt_id=attempt.id,
+            term=term,
+            score=attempt.score,
+            student_id=attempt.student_id,
+            test_id=attempt.test_id,
+            payload=pack_payload(results, [a.answer_option_id for a in attempt.answers])
+        )
+        db.session.add(archived)
+        for grade in attempt.grade:
+            db.session.add(ArchivedGrade(
+                original_grade_id=grade.id,
+                value=grade.value,
+                added_date=grade.added_date,
+                user_id=grade.user_id,
+                subject_id=grade.subject_id,
+                attempt=archived
+            ))
+    db.session.flush()
+
+    for model in (AttemptResult, AttemptAnswer, Grade):
+        db.session.execute(delete(model).where(model.attempt_id.in_(attempt_ids)))
+    db.session.execute(delete(StudentAttempt).where(StudentAttempt.id.in_(attempt_ids)))
+    db.session.commit()
+
+    # Bulk deletes bypass the identity map, so drop the stale objects
+    db.session.expunge_all()
+    return test_ids
+
+
+def init_archive(app, backfill_results):
+    # backfill_results builds AttemptResult rows for attempts submitted before
+    # they were stored, so every archived attempt has a complete payload
+    app.cli.add_command(archive_cli)
+
+    @archive_cli.command('term')
+    @click.option('--before', 'cutoff', required=True, type=click.DateTime(formats=['%Y-%m-%d']),
+                  help='Archive attempts graded before this date (start of the current term).')
+    @click.option('--name', 'term', default=None, help='Label for the archived term, e.g. 2024/2025.')
+    @click.option('--vacuum', is_flag=True, help='Run VACUUM afterwards to shrink the database file.')
+    def archive_term(cutoff, term, vacuum):
+        """Move attempts, answers, results and grades from a closed term into the archive tables."""
+        term = term or f"before-{cutoff:%Y-%m-%d}"
+        db.create_all()
+
+        # An attempt belongs to the term in which it was first graded (at submission)
+        closed = select(Grade.attempt_id) \
+            .group_by(Grade.attempt_id) \
+            .having(db.func.min(Grade.added_date) < cutoff)
+
+        archived = 0
+        touched_tests = set()
+        while True:
+            attempts = load_batch(StudentAttempt.id.in_(closed))
+            if not attempts:
+                break
+            touched_tests |= archive_batch(attempts, term, backfill_results)
+            archived += len(attempts)
+            click.echo(f"Archived {archived} attempts...")
+
+        if vacuum:
+            # VACUUM cannot run inside a transaction
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                conn.execute(text('VACUUM'))
+
+        click.echo(f"Done: {archived} attempts from {len(touched_tests)} tests archived as '{term}'.")
@@ -0,0 +1,132 @@
+import time
+import threading
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+from sqlalchemy import select, func
+
+from models import db, UserInfo, StudentAttempt
+
+
+class _Board:
+    # Scores are kept as a histogram (one entry per distinct score), so memory
+    # and rebuild cost follow the number of possible scores, not attempts
+    def __init__(self, histogram, max_attempt_id, top):
+        self.scores = [score for score, _ in histogram]  # distinct scores, ascending
+        self.counts = [count for _, count in histogram]  # attempts with each score
+        self.max_attempt_id = max_attempt_id             # newest attempt already counted
+        self.top = top                                   # top-k rows, best first
+        self.built_at = time.monotonic()
+        self._sum_counts()
+
+    def _sum_counts(self):
+        # below[i]: attempts that scored less than scores[i]; below[-1] is the total
+        self.below = list(accumulate(self.counts, initial=0))
+        self.total = self.below[-1]
+
+    def add(self, score):
+        i = bisect_left(self.scores, score)
+        if i < len(self.scores) and self.scores[i] == score:
+            self.counts[i] += 1
+        else:
+            self.scores.insert(i, score)
+            self.counts.insert(i, 1)
+        self._sum_counts()
+
+    # Attempts without a score are not ranked
+    def rank_of(self, score):
+        if score is None:
+            return None
+        return self.total - self.below[bisect_right(self.scores, score)] + 1
+
+    def percentile_of(self, score):
+        # Share of the other attempts that scored strictly lower (percent_rank)
+        if score is None:
+            return None
+        if self.total < 2:
+            return 100
+        return round(100 * self.below[bisect_left(self.scores, score)] / (self.total - 1))
+
+
+class LeaderboardCache:
+    # Per-test rankings built once with window functions and then kept up to
+    # date in memory as attempts are submitted. The TTL lets each worker pick
+    # up attempts written by other processes.
+
+    def __init__(self, top_k=10, ttl=60):
+        self.top_k = top_k
+        self.ttl = ttl
+        self._boards = {}
+        self._lock = threading.Lock()
+
+    def _build(self, test_id):
+        ranked = select(
+            StudentAttempt.id.label('attempt_id'),
+            StudentAttempt.student_id,
+            StudentAttempt.score,
+            func.rank().over(order_by=StudentAttempt.score.desc()).label('rank'),
+        ).where(StudentAttempt.test_id == test_id, StudentAttempt.score.is_not(None)).subquery()
+
+        rows = db.session.execute(
+            select(ranked, UserInfo.first_name, UserInfo.last_name)
+            .join(UserInfo, UserInfo.id == ranked.c.student_id)
+            .where(ranked.c.rank <= self.top_k)
+            .order_by(ranked.c.rank, ranked.c.attempt_id)
+        ).all()
+        top = [{
+            'attempt_id': r.attempt_id,
+            'student_id': r.student_id,
+            'student_name': f"{r.first_name} {r.last_name}",
+            'score': r.score,
+            'rank': r.rank,
+        } for r in rows]
+
+        histogram = db.session.execute(
+            select(StudentAttempt.score, func.count(), func.max(StudentAttempt.id))
+            .where(StudentAttempt.test_id == test_id, StudentAttempt.score.is_not(None))
+            .group_by(StudentAttempt.score)
+            .order_by(StudentAttempt.score)
+        ).all()
+        max_attempt_id = max((r[2] for r in histogram), default=0)
+        return _Board([(r[0], r[1]) for r in histogram], max_attempt_id, top)
+
+    def get(self, test_id):
+        with self._lock:
+            board = self._boards.get(test_id)
+            if board is not None and time.monotonic() - board.built_at < self.ttl:
+                return board
+
+        board = self._build(test_id)
+        with self._lock:
+            self._boards[test_id] = board
+        return board
+
+    def record(self, test_id, attempt_id, student_id, student_name, score):
+        with self._lock:
+            board = self._boards.get(test_id)
+            if board is None:
+                return  # Built on first read
+            # Ids only grow (sqlite_autoincrement) and SQLite commits one writer
+            # at a time, so anything at or below the high-water id is counted
+            if score is None or attempt_id <= board.max_attempt_id:
+                return  # Not ranked, or the board was rebuilt after the commit
+
+            board.max_attempt_id = attempt_id
+            board.add(score)
+            board.top.append({
+                'attempt_id': attempt_id,
+                'student_id': student_id,
+                'student_name': student_name,
+                'score': score,
+                'rank': 0,
+            })
+            for row in board.top:
+                row['rank'] = board.rank_of(row['score'])
+            board.top = sorted(
+                (row for row in board.top if row['rank'] <= self.top_k),
+                key=lambda row: (row['rank'], row['attempt_id'])
+            )
+
+    def invalidate(self, test_id):
+        with self._lock:
+            self._boards.pop(test_id, None)
@@ -0,0 +1,85 @@
+import json
+import queue
+import threading
+import time
+from collections import defaultdict
+
+HEARTBEAT_SECONDS = 15
+STATE_MAX_AGE = 3 * 3600  # Forget students who opened a test and never came back
+
+
+class EventChannel:
+    # In-process publish/subscribe, one topic per test. Each subscriber gets
+    # its own bounded queue; a slow subscriber loses events instead of
+    # blocking the request that published them. Works with the threaded dev
+    # server and needs no external broker, but only reaches subscribers
+    # connected to the same process.
+    #
+    # Besides events, each topic keeps a small keyed state (e.g. students
+    # currently taking the test) so a new subscriber can start from the
+    # current picture instead of replaying events.
+
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._subscribers = defaultdict(set)
+        self._state = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic):
+        q = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers[topic].add(q)
+        return q
+
+    def unsubscribe(self, topic, q):
+        with self._lock:
+            self._subscribers[topic].discard(q)
+            if not self._subscribers[topic]:
+                del self._subscribers[topic]
+
+    def set_state(self, topic, key, value):
+        with self._lock:
+            self._state[topic][key] = (time.monotonic(), value)
+
+    def clear_state(self, topic, key):
+        with self._lock:
+            self._state[topic].pop(key, None)
+            if not self._state[topic]:
+                del self._state[topic]
+
+    def state(self, topic):
+        cutoff = time.monotonic() - STATE_MAX_AGE
+        with self._lock:
+            entries = self._state.get(topic, {})
+            for key in [k for k, (updated, _) in entries.items() if updated < cutoff]:
+                del entries[key]
+            return {key: value for key, (_, value) in entries.items()}
+
+    def publish(self, topic, event, **data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+        if not subscribers:
+            return
+
+        message = format_sse(event, data)
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                pass
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream(q, first_message):
+    # Generator for a text/event-stream response reading from a queue the
+    # caller already subscribed; the periodic comment line lets the server
+    # notice disconnected clients
+    yield first_message
+    while True:
+        try:
+            yield q.get(timeout=HEARTBEAT_SECONDS)
+        except queue.Empty:
+            yield ": keepalive\n\n"
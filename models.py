@@ -1,6 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, UTC
-from sqlalchemy import CheckConstraint
+from sqlalchemy import CheckConstraint, UniqueConstraint
 
 db = SQLAlchemy()
 
@@ -41,6 +41,7 @@ class Grade(db.Model):
 
     __table_args__ = (
         CheckConstraint('value >= 2 AND value <= 5', name='Limit_Ocen'),
+        {'sqlite_autoincrement': True},  # Never reuse ids of archived grades
     )
 
     def __repr__(self):
@@ -130,6 +131,10 @@ class TestQuestion(db.Model):
 
 class StudentAttempt(db.Model):
     __tablename__ = 'student_attempts'
+    __table_args__ = (
+        UniqueConstraint('student_id', 'test_id', name='Jedno_Podejscie_Do_Testu'),
+        {'sqlite_autoincrement': True},  # Never reuse ids of archived attempts
+    )
     id = db.Column(db.Integer, primary_key=True)
     score = db.Column(db.Float, nullable=True)
 
@@ -153,4 +158,69 @@ class AttemptAnswer(db.Model):
     answer_option = db.relationship('AnswerOption')
 
     def __repr__(self):
-        return f'<AttemptAnswer {self.id}>'
\ No newline at end of file
+        return f'<AttemptAnswer {self.id}>'
+
+class AttemptResult(db.Model):
+    __tablename__ = 'attempt_results'
+    id = db.Column(db.Integer, primary_key=True)
+    points_awarded = db.Column(db.Integer, nullable=False)
+    points_possible = db.Column(db.Integer, nullable=False)
+
+    attempt_id = db.Column(db.Integer, db.ForeignKey('student_attempts.id'), nullable=False, index=True)
+    attempt = db.relationship('StudentAttempt', backref='results')
+
+    question_id = db.Column(db.Integer, db.ForeignKey('questions.id'), nullable=False)
+    question = db.relationship('Question')
+
+    chosen_option_id = db.Column(db.Integer, db.ForeignKey('answer_options.id'), nullable=True)
+    correct_option_id = db.Column(db.Integer, db.ForeignKey('answer_options.id'), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint('attempt_id', 'question_id', name='Jeden_Wynik_Na_Pytanie'),
+    )
+
+    @property
+    def correct(self):
+        return self.chosen_option_id is not None and self.chosen_option_id == self.correct_option_id
+
+    def __repr__(self):
+        return f'<AttemptResult {self.id}>'
+
+class ArchivedAttempt(db.Model):
+    __tablename__ = 'archived_attempts'
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True)
+    original_attempt_id = db.Column(db.Integer, nullable=False, index=True)  # student_attempts.id before archiving
+    term = db.Column(db.String(50), nullable=False, index=True)
+    score = db.Column(db.Float, nullable=True)
+    # zlib-compressed JSON: per-question results and chosen answer option ids
+    payload = db.Column(db.LargeBinary, nullable=False)
+
+    student_id = db.Column(db.Integer, db.ForeignKey('user_info.id'), nullable=False, index=True)
+    student = db.relationship('UserInfo', backref='archived_attempts')
+
+    test_id = db.Column(db.Integer, db.ForeignKey('tests.id'), nullable=False, index=True)
+    test = db.relationship('Test', backref='archived_attempts')
+
+    def __repr__(self):
+        return f'<ArchivedAttempt {self.id}>'
+
+class ArchivedGrade(db.Model):
+    __tablename__ = 'archived_grades'
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True)
+    original_grade_id = db.Column(db.Integer, nullable=False)  # grades.id before archiving
+    value = db.Column(db.Integer, nullable=False)
+    added_date = db.Column(db.DateTime, nullable=False)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user_info.id'), nullable=False, index=True)
+    user = db.relationship('UserInfo', backref='archived_grades')
+
+    subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'), nullable=False)
+    subject = db.relationship('Subject')
+
+    attempt_id = db.Column(db.Integer, db.ForeignKey('archived_attempts.id'), nullable=False, index=True)
+    attempt = db.relationship('ArchivedAttempt', backref='grades')
+
+    def __repr__(self):
+        return f'<ArchivedGrade {self.id}>'
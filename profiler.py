@@ -0,0 +1,148 @@
+import os
+import time
+import random
+import cProfile
+import pstats
+from collections import defaultdict
+
+import click
+from flask import request, g, current_app
+from flask.cli import AppGroup
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+PROFILE_HEADER = 'X-Profile-Token'
+TOKEN_MAX_AGE = 3600  # Signed tokens are valid for one hour
+
+profile_cli = AppGroup('profile', help='Request profiling tools.')
+
+
+def _serializer(app):
+    return URLSafeTimedSerializer(app.secret_key, salt='request-profile')
+
+
+def _wants_profile(app):
+    # Explicit request from someone holding a token signed with the app secret
+    token = request.headers.get(PROFILE_HEADER)
+    if token:
+        try:
+            _serializer(app).loads(token, max_age=TOKEN_MAX_AGE)
+            return True
+        except BadSignature:
+            pass
+
+    rate = app.config.get('PROFILE_SAMPLE_RATE', 0)
+    return rate > 0 and random.random() < rate
+
+
+def init_profiler(app):
+    app.cli.add_command(profile_cli)
+
+    # Hooks are only installed when a profile directory is configured,
+    # so a disabled profiler adds nothing to the request path
+    if not app.config.get('PROFILE_DIR'):
+        return
+
+    @app.before_request
+    def _start_profile():
+        if request.endpoint in (None, 'static') or not _wants_profile(app):
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another request on this interpreter is already being profiled
+            return
+        g._profiler = profiler
+
+    @app.teardown_request
+    def _stop_profile(exc):
+        profiler = g.pop('_profiler', None)
+        if profiler is None:
+            return
+        profiler.disable()
+
+        out_dir = os.path.join(app.config['PROFILE_DIR'], request.endpoint)
+        os.makedirs(out_dir, exist_ok=True)
+        filename = f"{time.time_ns()}-{os.getpid()}.prof"
+        profiler.dump_stats(os.path.join(out_dir, filename))
+
+
+def _func_label(func):
+    filename, line, name = func
+    if filename == '~':
+        return name  # Built-ins such as <method 'execute' ...>
+    return f"{os.path.basename(filename)}:{line}({name})"
+
+
+def collapse_stats(stats, max_depth=64, min_weight=1):
+    # cProfile only records caller -> callee edges, so full stacks are
+    # reconstructed by walking from the roots and splitting each function's
+    # time across callers in proportion to the edge's cumulative time
+    raw = stats.stats
+    children = defaultdict(list)
+    roots = []
+    for func, (_, _, _, _, callers) in raw.items():
+        if not callers:
+            roots.append(func)
+        for caller, edge in callers.items():
+            children[caller].append((func, edge[3]))
+
+    lines = defaultdict(int)
+
+    def walk(func, path, fraction):
+        tt, ct = raw[func][2], raw[func][3]
+        path = path + [_func_label(func)]
+        self_us = int(tt * fraction * 1_000_000)
+        if self_us >= min_weight:
+            lines[';'.join(path)] += self_us
+
+        if len(path) >= max_depth:
+            return
+        for child, edge_ct in children.get(func, []):
+            child_ct = raw[child][3]
+            if child_ct <= 0 or _func_label(child) in path:
+                continue
+            child_fraction = edge_ct * fraction / child_ct
+            if child_ct * child_fraction * 1_000_000 >= min_weight:
+                walk(child, path, child_fraction)
+
+    for root in roots:
+        walk(root, [], 1.0)
+
+    return lines
+
+
+@profile_cli.command('token')
+def profile_token():
+    """Print a signed token for the X-Profile-Token header."""
+    click.echo(_serializer(current_app).dumps('profile'))
+
+
+@profile_cli.command('merge')
+@click.option('--src', default=None, help='Directory with raw samples (defaults to PROFILE_DIR).')
+@click.option('--out', default=None, help='Output directory (defaults to <src>/merged).')
+def profile_merge(src, out):
+    """Merge per-request samples into one .prof and .collapsed file per endpoint."""
+    src = src or current_app.config.get('PROFILE_DIR')
+    if not src or not os.path.isdir(src):
+        raise click.ClickException('No profile directory found. Set PROFILE_DIR or pass --src.')
+    out = out or os.path.join(src, 'merged')
+    os.makedirs(out, exist_ok=True)
+
+    for endpoint in sorted(os.listdir(src)):
+        endpoint_dir = os.path.join(src, endpoint)
+        if endpoint_dir == out or not os.path.isdir(endpoint_dir):
+            continue
+        samples = [os.path.join(endpoint_dir, f) for f in os.listdir(endpoint_dir) if f.endswith('.prof')]
+        if not samples:
+            continue
+
+        stats = pstats.Stats(*samples)
+        stats.dump_stats(os.path.join(out, f"{endpoint}.prof"))
+
+        # Collapsed stacks in microseconds, ready for flamegraph.pl or speedscope
+        with open(os.path.join(out, f"{endpoint}.collapsed"), 'w') as fh:
+            for stack, weight in sorted(collapse_stats(stats).items()):
+                fh.write(f"{stack} {weight}\n")
+
+        click.echo(f"{endpoint}: {len(samples)} samples")